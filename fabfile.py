@@ -23,11 +23,14 @@
 
 from fabric.api import sudo, local, warn_only, task, env, execute
 from subprocess import check_output
-from time import sleep
+from time import sleep, time
 from fabric.colors import green as _green, yellow as _yellow, red as _red
 import os
+import errno
 import json
+import select
 import socket
+import threading
 from textwrap import dedent
 from urlparse import urljoin
 
@@ -42,12 +45,52 @@ except:
     import boto.ec2
 
 
+DEVELOPMENT_PACKAGES = ["kernel-devel", "kernel", "kernel-headers", "dkms",
+                        "gcc", "git", "make", "psutils-perl", "lsof", "rsync"]
+FIREWALLD_PACKAGES = ['firewalld']
+DOCKER_PACKAGES = ['docker', 'docker-registry']
+
+
+# openssh options used by rsync and ssh, so that they share a single
+# persistent master connection to the box instead of doing a new ssh
+# handshake every time.
+SSH_CONTROL_OPTIONS = ('-o ControlMaster=auto '
+                       '-o ControlPath=/tmp/cm-%r@%h:%p '
+                       '-o ControlPersist=10m')
+
+
+# created next to 'data.json' once the code has been synced to the box
+RSYNC_MARKER = '.rsync-bootstrapped'
+
+
+# rpm packages installed on each host, see installed_packages()
+_installed_packages = {}
+
+# docker images and containers on each host, see docker_snapshot()
+_docker_snapshots = {}
+
+# the parsed contents of 'data.json', see load_state_from_disk()
+_state_cache = {'mtime': None, 'data': None}
+_state_cache_lock = threading.Lock()
+
+_ec2_conn = None
+_ec2_conn_lock = threading.Lock()
+
+
 def connect_to_ec2():
-    """ returns a connection object to AWS EC2  """
-    conn = boto.ec2.connect_to_region(env.ec2_region,
-                                      aws_access_key_id=env.ec2_key,
-                                      aws_secret_access_key=env.ec2_secret)
-    return conn
+    """ returns a connection object to AWS EC2
+
+        the connection is created once and shared, so that its pool of
+        HTTPS connections is reused across all our EC2 calls.
+    """
+    global _ec2_conn
+    with _ec2_conn_lock:
+        if _ec2_conn is None:
+            _ec2_conn = boto.ec2.connect_to_region(
+                env.ec2_region,
+                aws_access_key_id=env.ec2_key,
+                aws_secret_access_key=env.ec2_secret)
+    return _ec2_conn
 
 
 def is_there_state():
@@ -58,26 +101,77 @@ def is_there_state():
         return False
 
 
-def is_ssh_available(host, port=22):
-    """ checks if ssh port is open """
+def is_ssh_available(host, port=22, timeout=0.5):
+    """ checks if ssh port is open
+
+        uses a non-blocking connect, so that we never wait more than
+        'timeout' seconds for an answer.
+    """
     s = socket.socket()
     try:
-        s.connect((host, port))
-        return True
+        s.setblocking(False)
+        err = s.connect_ex((host, port))
+        if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            return False
+        _, writable, _ = select.select([], [s], [], timeout)
+        if not writable:
+            return False
+        return s.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) == 0
     except socket.error, e:
         return False
+    finally:
+        s.close()
 
 
 def wait_for_ssh(host, port=22, timeout=600):
-    """ probes the ssh port and waits until it is available """
+    """ probes the ssh port and waits until it is available
+
+        the delay between probes grows exponentially up to one second, so
+        that we retry quickly right after boot.
+    """
     yellow('waiting for ssh...')
-    for iteration in xrange(1, timeout):
+    deadline = time() + timeout
+    attempt = 0
+    while time() < deadline:
         if is_ssh_available(host, port):
             green('ssh is now available.')
             return True
-        else:
+        # only report progress every few attempts to avoid flooding stdout
+        if attempt % 10 == 0:
             yellow('waiting for ssh...')
-        sleep(1)
+        sleep(max(0, min(1.0, 0.05 * 1.3 ** attempt, deadline - time())))
+        attempt += 1
+    return False
+
+
+def wait_for_state(instance, target, timeout=600):
+    """ polls EC2 until the instance reaches the target state
+
+        p instance: a boto ec2 instance object
+        p target: the state to wait for, ie: 'running', 'stopped'
+        p timeout: how long to wait in seconds before giving up
+
+        aborts if the instance times out, or ends up being terminated
+        while we wait for any other state.
+    """
+    deadline = time() + timeout
+    attempt = 0
+    last_state = None
+    while instance.state != target:
+        if instance.state != last_state:
+            yellow("Instance state: %s" % instance.state)
+            last_state = instance.state
+        if (target != 'terminated' and
+                instance.state in ('shutting-down', 'terminated')):
+            red("instance is %s, it will never be %s" % (instance.state,
+                                                          target))
+            raise SystemExit()
+        if time() >= deadline:
+            red("timed out waiting for instance state: %s" % target)
+            raise SystemExit()
+        sleep(max(0, min(15, 0.5 * 1.3 ** attempt, deadline - time())))
+        attempt += 1
+        instance.update()
 
 
 def green(msg):
@@ -130,10 +224,7 @@ def create_server():
         # add a tag to our instance
         conn.create_tags([instance.id], {"Name": env.ec2_instance_name})
         #  and loop and wait until ssh is available
-        while instance.state == u'pending':
-            yellow("Instance state: %s" % instance.state)
-            sleep(10)
-            instance.update()
+        wait_for_state(instance, u'running')
         wait_for_ssh(instance.public_dns_name)
 
         green("Instance state: %s" % instance.state)
@@ -142,24 +233,36 @@ def create_server():
         save_state_locally(instance.id)
 
 
-def save_state_locally(instance_id):
+def save_state_locally(instance_id, data=None):
     """ queries EC2 for details about a particular instance_id and
         stores those details locally
+
+        p data: details previously returned by get_ec2_info, saves an
+                additional EC2 round trip when the caller already has them
     """
-    data = get_ec2_info(instance_id)
-    with open('data.json', 'w') as f:
-        json.dump(data, f)
+    if data is None:
+        data = get_ec2_info(instance_id)
+    with _state_cache_lock:
+        with open('data.json', 'w') as f:
+            json.dump(data, f)
+        _state_cache['mtime'] = None
 
 
 def load_state_from_disk():
     """ saves state in a local 'data.json' file so that it can be
         reused between fabric runs.
+
+        the parsed file is cached, and only read again when its
+        modification time changes.
     """
     if is_there_state():
-        import json
-        with open('data.json', 'r') as f:
-            data = json.load(f)
-        return data
+        mtime = os.stat('data.json').st_mtime
+        with _state_cache_lock:
+            if _state_cache['mtime'] != mtime:
+                with open('data.json', 'r') as f:
+                    _state_cache['data'] = json.load(f)
+                _state_cache['mtime'] = mtime
+            return _state_cache['data']
     else:
         return False
 
@@ -169,39 +272,56 @@ def print_ec2_info():
     """ outputs information about our EC2 instance """
     _state = load_state_from_disk()
     if _state:
-        data = get_ec2_info(_state['id'])
-        green("Instance state: %s" % data['state'])
-        green("Public dns: %s" % data['public_dns_name'])
-        green("Ip address: %s" % data['ip_address'])
-        green("volume: %s" % data['volume'])
-        green("user: %s" % env.user)
-        green("ssh -i %s %s@%s" % (env.key_filename,
-                                        env.user,
-                                        data['ip_address']))
+        show_ec2_info(get_ec2_info(_state['id']))
+
+
+def show_ec2_info(data):
+    """ prints the details returned by get_ec2_info """
+    green("Instance state: %s" % data['state'])
+    green("Public dns: %s" % data['public_dns_name'])
+    green("Ip address: %s" % data['ip_address'])
+    green("volume: %s" % data['volume'])
+    green("user: %s" % env.user)
+    green("ssh -i %s %s@%s" % (env.key_filename,
+                                env.user,
+                                data['ip_address']))
 
 
 def get_ec2_info(instance_id):
     """ queries EC2 for details about a particular instance_id
     """
-    conn = connect_to_ec2()
-    instance = conn.get_only_instances(
-        filters={'instance_id': instance_id}
-        )[0]
+    return get_ec2_infos([instance_id])[instance_id]
 
 
-    data = {}
-    data['public_dns_name'] = instance.public_dns_name
-    data['id'] = instance.id
-    data['ip_address'] = instance.ip_address
-    data['architecture'] = instance.architecture
-    data['state'] = instance.state
+def get_ec2_infos(instance_ids):
+    """ queries EC2 for details about several instance_ids at once
+
+        uses a single DescribeInstances and a single DescribeVolumes call
+        for all the instances, and returns a dict keyed by instance_id.
+    """
+    conn = connect_to_ec2()
+    instances = conn.get_only_instances(instance_ids=list(instance_ids))
+
+    # bucket the attached volumes by the instance they belong to
+    volumes = {}
     try:
-        volume = conn.get_all_volumes(
-            filters={'attachment.instance-id': instance.id})[0].id
-        data['volume'] = volume
+        for volume in conn.get_all_volumes(
+                filters={'attachment.instance-id': list(instance_ids)}):
+            volumes.setdefault(volume.attach_data.instance_id, volume.id)
     except:
-        data['volume'] = ''
-    return data
+        pass
+
+    result = {}
+    for instance in instances:
+        data = {}
+        data['public_dns_name'] = instance.public_dns_name
+        data['id'] = instance.id
+        data['ip_address'] = instance.ip_address
+        data['architecture'] = instance.architecture
+        data['state'] = instance.state
+        data['volume'] = volumes.get(instance.id, '')
+        result[instance.id] = data
+    return result
 
 
 @task
@@ -211,16 +331,26 @@ def rsync():
     green('syncing code to remote box...')
     data = load_state_from_disk()
     if 'SOURCE_PATH' in os.environ:
+        # on the first sync there is nothing on the remote box to compute a
+        # delta against, so just copy whole files.
+        if os.path.isfile(RSYNC_MARKER):
+            whole_file = ''
+        else:
+            whole_file = '--whole-file --inplace '
         with lcd(os.environ['SOURCE_PATH']):
             local("rsync  -a "
                 "--info=progress2 "
+                "%s"
                 "--exclude .git "
                 "--exclude .tox "
                 "--exclude .vagrant "
                 "--exclude venv "
                 ". "
-                "-e 'ssh -C -i " + env.ec2_key_filename + "' "
-                "%s@%s:" % (env.user, data['ip_address']))
+                "-e 'ssh -C %s -i %s' "
+                "%s@%s:" % (whole_file,
+                            SSH_CONTROL_OPTIONS, env.ec2_key_filename,
+                            env.user, data['ip_address']))
+        local('touch %s' % RSYNC_MARKER)
     else:
         print('please export SOURCE_PATH before running rsync')
         exit(1)
@@ -244,18 +374,15 @@ def up():
         data = load_state_from_disk()
         # boot the ec2 instance
         instance = conn.start_instances(instance_ids=[data['id']])[0]
-        while instance.state != "running":
-            print(_yellow("Instance state: %s" % instance.state))
-            sleep(10)
-            instance.update()
+        wait_for_state(instance, "running")
         # the ip_address has changed so we need to get the latest data from ec2
         data = get_ec2_info(data['id'])
         # and make sure we don't return until the instance is fully up
         wait_for_ssh(data['ip_address'])
         # lets update our local state file with the new ip_address
-        save_state_locally(instance.id)
+        save_state_locally(instance.id, data)
         env.hosts = data['ip_address']
-        print_ec2_info()
+        show_ec2_info(data)
 
 
 @task
@@ -270,10 +397,7 @@ def down():
         # get the instance_id from the state file, and stop the instance
         data = load_state_from_disk()
         instance = conn.stop_instances(instance_ids=[data['id']])[0]
-        while instance.state != "stopped":
-            print(_yellow("Instance state: %s" % instance.state))
-            sleep(10)
-            instance.update()
+        wait_for_state(instance, "stopped")
 
 
 @task
@@ -292,15 +416,14 @@ def destroy():
         data = get_ec2_info(_state['id'])
         instance = conn.terminate_instances(instance_ids=[data['id']])[0]
         yellow('destroying instance ...')
-        while instance.state != "terminated":
-            print(_yellow("Instance state: %s" % instance.state))
-            sleep(10)
-            instance.update()
+        wait_for_state(instance, "terminated")
         volume = data['volume']
         if volume:
             yellow('destroying EBS volume ...')
             conn.delete_volume(volume)
         os.unlink('data.json')
+        if os.path.isfile(RSYNC_MARKER):
+            os.unlink(RSYNC_MARKER)
 
 
 @task
@@ -314,32 +437,54 @@ def install_python_module(name):
 
 
 def disable_selinux():
-    """ disables selinux """
+    """ disables selinux
+
+        returns True if the box needs a reboot for selinux to be disabled,
+        either because we just changed its config or because a previous
+        change hasn't taken effect yet.
+    """
+    from fabric.api import settings
+    from fabric.context_managers import hide
     from fabric.contrib.files import sed, contains
 
+    changed = False
     if contains(filename='/etc/selinux/config',
                 text='SELINUX=enforcing'):
         sed('/etc/selinux/config',
             'SELINUX=enforcing', 'SELINUX=disabled', use_sudo=True)
+        changed = True
 
     if contains(filename='/etc/selinux/config',
                 text='SELINUXTYPE=enforcing'):
         sed('/etc/selinux/config',
             'SELINUXTYPE=enforcing', 'SELINUX=targeted', use_sudo=True)
+        changed = True
+
+    with settings(hide('warnings', 'running', 'stdout', 'stderr'),
+                  warn_only=True, capture=True):
+        enforce = sudo('getenforce').strip()
+
+    return changed or enforce != 'Disabled'
 
 
 def yum_install(**kwargs):
     """
-        installs a yum package
+        installs yum packages, in a single yum transaction
     """
-    for pkg in list(kwargs['packages']):
-        if is_package_installed(pkg) is False:
-            if 'repo' in kwargs:
-                green("installing %s from repo %s ..." % (pkg, repo))
-                sudo("yum install -y --quiet --enablerepo=%s %s" % (repo, pkg))
-            else:
-                green("installing %s ..." % pkg)
-                sudo("yum install -y --quiet %s" % pkg)
+    missing = missing_packages(kwargs['packages'])
+    if not missing:
+        return
+    pkgs = " ".join(missing)
+    try:
+        if 'repo' in kwargs:
+            repo = kwargs['repo']
+            green("installing %s from repo %s ..." % (pkgs, repo))
+            sudo("yum install -y --quiet --enablerepo=%s %s" % (repo, pkgs))
+        else:
+            green("installing %s ..." % pkgs)
+            sudo("yum install -y --quiet %s" % pkgs)
+    finally:
+        forget_installed_packages()
 
 
 def yum_install_from_url(pkg_name, url):
@@ -356,6 +501,7 @@ def yum_install_from_url(pkg_name, url):
                     warn_only=True, capture=True):
 
             result = sudo("yum install --quiet -y %s" % url)
+            forget_installed_packages()
             if result.return_code == 0:
                 return True
             elif result.return_code == 1:
@@ -387,42 +533,62 @@ def systemd(service, start=True, enabled=True, unmask=False):
             sudo('systemctl unmask %s' % service)
 
 
-def sleep_for_one_minute():
-    local(sleep(60))
-
-
 def reboot():
     sudo('shutdown -r now')
 
 
-def is_package_installed(pkg):
-    """ checks if a particular rpm package is installed """
+def installed_packages():
+    """ returns the set of rpm packages installed on the current host
+
+        the list is fetched once with a single 'rpm -qa' call and cached per
+        host, call forget_installed_packages() after installing anything.
+    """
     from fabric.api import settings
     from fabric.context_managers import hide
 
-    with settings(hide('warnings', 'running', 'stdout', 'stderr'),
-                  warn_only=True, capture=True):
+    host = env.host_string
+    if host not in _installed_packages:
+        with settings(hide('warnings', 'running', 'stdout', 'stderr'),
+                      warn_only=True, capture=True):
+
+            result = sudo("rpm -qa --qf '%{NAME}\\n'")
+            if result.return_code != 0:
+                #print error to user
+                print result
+                raise SystemExit()
+        _installed_packages[host] = set(result.split())
+    return _installed_packages[host]
+
+
+def forget_installed_packages():
+    """ invalidates the cached list of installed rpm packages """
+    _installed_packages.pop(env.host_string, None)
+
+
+def is_package_installed(pkg):
+    """ checks if a particular rpm package is installed """
+    return pkg in installed_packages()
 
-        result = sudo("rpm -q %s" % pkg)
-        if result.return_code == 0:
-            return True
-        elif result.return_code == 1:
-            return False
-        else: #print error to user
-            print result
-            raise SystemExit()
+
+def missing_packages(packages):
+    """ returns the rpm packages from a list which are not installed """
+    installed = installed_packages()
+    return [pkg for pkg in packages if pkg not in installed]
 
 
 def install_os_updates():
     """ installs OS updates """
     sudo("yum -y --quiet update")
+    forget_installed_packages()
 
 
-def install_development_packages():
+def install_packages():
     """ Update the kernel and install some development tools necessary for
-     building the ZFS kernel module. """
-    yum_install(packages = ["kernel-devel", "kernel", "kernel-headers",
-                "dkms", "gcc", "git", "make", "psutils-perl", "lsof", "rsync"])
+     building the ZFS kernel module, together with the firewalld and docker
+     packages in a single yum transaction. """
+    yum_install(packages=DEVELOPMENT_PACKAGES +
+                FIREWALLD_PACKAGES +
+                DOCKER_PACKAGES)
 
 
 def add_epel_yum_repository():
@@ -451,13 +617,13 @@ def create_docker_group():
 
 def enable_firewalld_service():
     """ install and enables the firewalld service """
-    yum_install(packages=['firewalld'])
+    yum_install(packages=FIREWALLD_PACKAGES)
     systemd(service='firewalld', unmask=True)
 
 
 def add_firewall_service(service, permanent=True):
     """ adds a firewall rule """
-    yum_install(packages=['firewalld'])
+    yum_install(packages=FIREWALLD_PACKAGES)
     from fabric.api import settings
     from fabric.context_managers import hide
 
@@ -471,7 +637,14 @@ def add_firewall_service(service, permanent=True):
 
 def add_firewall_port(port, permanent=True):
     """ adds a firewall rule """
-    yum_install(packages=['firewalld'])
+    add_firewall_ports([port], permanent)
+
+
+def add_firewall_ports(ports, permanent=True):
+    """ adds firewall rules for several ports with a single firewall-cmd
+        call, permanent rules are then loaded with a single reload
+    """
+    yum_install(packages=FIREWALLD_PACKAGES)
     from fabric.api import settings
     from fabric.context_managers import hide
 
@@ -479,22 +652,26 @@ def add_firewall_port(port, permanent=True):
                 warn_only=True, capture=True):
         p = ''
         if permanent:
-            p = '--permanent'
-        sudo('firewall-cmd --add-port %s %s' % (port, p))
+            p = '--permanent '
+        sudo('firewall-cmd %s%s' % (p, ' '.join('--add-port=%s' % port
+                                                 for port in ports)))
+        if permanent:
+            sudo('firewall-cmd --reload')
 
 @task
 def ssh(*cli):
     from itertools import chain
     """ opens a ssh shell to the host """
     data = load_state_from_disk()
-    local('ssh -t -i %s %s@%s %s' % (env['ec2_key_filename'],
+    local('ssh -t %s -i %s %s@%s %s' % (SSH_CONTROL_OPTIONS,
+                               env['ec2_key_filename'],
                                env['user'], data['ip_address'],
                                "".join(chain.from_iterable(cli))))
 
 
 def install_docker():
     """ installs docker """
-    yum_install(packages=['docker', 'docker-registry'])
+    yum_install(packages=DOCKER_PACKAGES)
     systemd('docker.service')
 
 
@@ -516,68 +693,139 @@ def pull_docker_image(image):
             raise SystemExit()
 
 
+def pull_docker_images(images):
+    """ pulls several docker images concurrently
+
+        images that are already present are skipped, the remaining ones are
+        pulled in parallel by the docker daemon from a single remote shell.
+    """
+    from fabric.api import settings
+    from fabric.context_managers import hide
+
+    pulls = " ".join(
+        "(docker inspect --type=image %s >/dev/null 2>&1 || "
+        "docker pull %s) & pids=\"$pids $!\";" % (image, image)
+        for image in images)
+    with settings(hide('warnings', 'running', 'stdout', 'stderr'),
+                warn_only=True, capture=True):
+
+        result = sudo('pids=""; %s rc=0; '
+                      'for pid in $pids; do wait $pid || rc=1; done; '
+                      'exit $rc' % pulls)
+        forget_docker_snapshot()
+        if result.return_code == 0:
+            return True
+        elif result.return_code == 1:
+            return False
+        else: #print error to user
+            print result
+            raise SystemExit()
+
+
 def cache_docker_images():
     """ pulls some docker images locally """
     green('refreshing docker images...')
-    for image in ["busybox",
-                  "clusterhq/mongodb",
-                  "redis",
-                  "clusterhq/flask",
-                  "python:2.7-slim"]:
-        pull_docker_image(image)
+    pull_docker_images(["busybox",
+                        "clusterhq/mongodb",
+                        "redis",
+                        "clusterhq/flask",
+                        "python:2.7-slim"])
 
 
 def check_for_missing_environment_variables():
     """ double checks that the minimum environment variables have been setup """
-    env_var_missing = []
-    for env_var in ['AWS_KEY_PAIR',
-                    'AWS_KEY_FILENAME',
-                    'AWS_SECRET_ACCESS_KEY',
-                    'AWS_ACCESS_KEY_ID']:
-        if not env_var in os.environ:
-            env_var_missing.append(env_var)
+    env_var_missing = set(['AWS_KEY_PAIR',
+                           'AWS_KEY_FILENAME',
+                           'AWS_SECRET_ACCESS_KEY',
+                           'AWS_ACCESS_KEY_ID']) - set(os.environ)
 
     if env_var_missing:
         print('the following environment variables must be set:')
-        for env_var in env_var_missing:
+        for env_var in sorted(env_var_missing):
             print(env_var)
-        return True
+    return bool(env_var_missing)
 
 
-def does_container_exist(container):
+def docker_snapshot():
+    """ returns the docker images and containers on the current host
+
+        returns a tuple of two dicts, mapping image names and container
+        names to their ids. They are fetched with one 'docker images' and
+        one 'docker ps' call and cached per host, call
+        forget_docker_snapshot() after changing images or containers.
+    """
     from fabric.api import settings
-    with settings(warn_only=True):
-        result = sudo('docker inspect %s' % container)
-        print('*********************************************')
-        red(result.return_code)
-    if result.return_code is 0:
-        return True
-    else:
-        return False
+    from fabric.context_managers import hide
+
+    host = env.host_string
+    if host not in _docker_snapshots:
+        with settings(hide('warnings', 'running', 'stdout', 'stderr'),
+                      warn_only=True, capture=True):
+            images_result = sudo(
+                "docker images --format '{{.Repository}} {{.Tag}} {{.ID}}'")
+            containers_result = sudo(
+                "docker ps -a --format '{{.Names}} {{.ID}}'")
+            for result in (images_result, containers_result):
+                if result.return_code != 0:
+                    #print error to user
+                    print result
+                    raise SystemExit()
+
+        # images are matched exactly, either by repository or by
+        # repository:tag, dangling '<none>' images are left out.
+        images = {}
+        for line in images_result.splitlines():
+            fields = line.split()
+            if len(fields) != 3 or fields[0] == '<none>':
+                continue
+            repository, tag, image_id = fields
+            # a bare repository name refers to its 'latest' tag
+            if tag == 'latest':
+                images[repository] = image_id
+            if tag != '<none>':
+                images['%s:%s' % (repository, tag)] = image_id
+
+        containers = {}
+        for line in containers_result.splitlines():
+            fields = line.split()
+            if len(fields) == 2:
+                for name in fields[0].split(','):
+                    containers[name] = fields[1]
+
+        _docker_snapshots[host] = (images, containers)
+    return _docker_snapshots[host]
+
+
+def forget_docker_snapshot():
+    """ invalidates the cached docker images and containers """
+    _docker_snapshots.pop(env.host_string, None)
+
+
+def does_container_exist(container):
+    return container in docker_snapshot()[1]
 
 
 def get_image_id(image):
-        result = sudo("docker images | grep %s | awk '{print $3}'" % image)
-        return result
+    return docker_snapshot()[0].get(image)
+
 
 def get_container_id(container):
-        result = sudo("docker ps -a | grep %s | awk '{print $1}'" % container)
-        return result
+    return docker_snapshot()[1].get(container)
+
 
 def does_image_exist(image):
-    from fabric.api import settings
-    with settings(warn_only=True):
-        result = sudo('docker images')
-        if image in result:
-            return True
-        else:
-            return False
+    return image in docker_snapshot()[0]
+
 
 def remove_image(image):
     sudo('docker rmi -f %s' % get_image_id(image))
+    forget_docker_snapshot()
+
 
 def remove_container(container):
     sudo('docker rm -f %s' % get_container_id(container))
+    forget_docker_snapshot()
+
 
 def git_clone_grafana():
     sudo('rm -rf graphite_docker')
@@ -585,6 +833,7 @@ def git_clone_grafana():
 
 def build_metrics_platform_image():
     sudo('cd graphite_docker && docker build -t metrics_platform_img .')
+    forget_docker_snapshot()
 
 @task
 def deploy_metrics_platform():
@@ -604,11 +853,9 @@ def deploy_metrics_platform():
     sudo('docker run -d --name metrics_platform -it -v `pwd`/data:/data '
          '-p 14000:80 -p 14001:3000 -p 2003:2003 -p 8125:8125/udp'
          ' metrics_platform_img')
+    forget_docker_snapshot()
 
-    add_firewall_port('14000/tcp')
-    add_firewall_port('14001/tcp')
-    add_firewall_port('8125/udp')
-    add_firewall_port('2003/tcp')
+    add_firewall_ports(['14000/tcp', '14001/tcp', '8125/udp', '2003/tcp'])
 
 
 @task
@@ -619,13 +866,14 @@ def it():
     # ip address of our box before we continue our provisioning tasks.
     # we load the state from disk, and store the ip in ec2_host#
     ec2_host="%s@%s" %(env.user, load_state_from_disk()['ip_address'])
-    execute(disable_selinux, hosts=ec2_host)
-    execute(down, hosts=ec2_host)
-    execute(up, hosts=ec2_host)
-    ec2_host="%s@%s" %(env.user, load_state_from_disk()['ip_address'])
-    execute(install_os_updates, hosts=ec2_host)
+    # only reboot the box when selinux is still enabled
+    if any(execute(disable_selinux, hosts=ec2_host).values()):
+        execute(down, hosts=ec2_host)
+        execute(up, hosts=ec2_host)
+        ec2_host="%s@%s" %(env.user, load_state_from_disk()['ip_address'])
     execute(add_epel_yum_repository, hosts=ec2_host)
-    execute(install_development_packages, hosts=ec2_host)
+    execute(install_os_updates, hosts=ec2_host)
+    execute(install_packages, hosts=ec2_host)
     execute(enable_firewalld_service, hosts=ec2_host)
     execute(install_docker, hosts=ec2_host)
     execute(create_docker_group, hosts=ec2_host)